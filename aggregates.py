@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+
+# Published next to course_results.json by fetch_courses.py
+AGGREGATES_FILE = "course_aggregates.json"
+
+# enrolledPercentage histogram: 20 buckets of 5%, anything >= 100% lands in the last one.
+# Histograms merge by addition, so percentiles stay answerable after incremental updates.
+ENROLLED_BUCKETS = 20
+
+
+# Aggregates record the sha256 of the snapshot bytes they describe, so readers can tell
+# a table from another fetch apart even when the course count is unchanged
+def snapshot_hash(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def empty_aggregate():
+    return {
+        "courses": 0,
+        "open_seats": 0,
+        "enrolled_sum": 0.0,
+        "enrolled_histogram": [0] * ENROLLED_BUCKETS,
+        "graded_courses": 0,
+        "grade_sum": 0.0,
+        "letter_grades": {},
+        "most_open_id": None,
+        "most_open_seats": None,
+    }
+
+
+def _enrolled_bucket(value):
+    return min(max(int(value * ENROLLED_BUCKETS), 0), ENROLLED_BUCKETS - 1)
+
+
+# Add (sign=1) or remove (sign=-1) one course's contribution to the additive fields
+def apply_course(agg, course, sign=1):
+    agg["courses"] += sign
+    agg["open_seats"] += sign * course["openSeats"]
+    enrolled = course.get("enrolledPercentage")
+    if enrolled is not None:
+        agg["enrolled_sum"] += sign * enrolled
+        agg["enrolled_histogram"][_enrolled_bucket(enrolled)] += sign
+    grade = course.get("gradeAverage")
+    if grade is not None and grade != -1:
+        agg["graded_courses"] += sign
+        agg["grade_sum"] += sign * grade
+        letter = course.get("letterAverage") or "?"
+        count = agg["letter_grades"].get(letter, 0) + sign
+        if count:
+            agg["letter_grades"][letter] = count
+        else:
+            agg["letter_grades"].pop(letter, None)
+
+
+def _set_most_open(agg, courses):
+    best = max(courses, key=lambda c: c["openSeats"], default=None)
+    agg["most_open_id"] = best["id"] if best else None
+    agg["most_open_seats"] = best["openSeats"] if best else None
+
+
+def merge_aggregates(parts):
+    total = empty_aggregate()
+    for agg in parts:
+        total["courses"] += agg["courses"]
+        total["open_seats"] += agg["open_seats"]
+        total["enrolled_sum"] += agg["enrolled_sum"]
+        total["enrolled_histogram"] = [a + b for a, b in zip(total["enrolled_histogram"], agg["enrolled_histogram"])]
+        total["graded_courses"] += agg["graded_courses"]
+        total["grade_sum"] += agg["grade_sum"]
+        for letter, count in agg["letter_grades"].items():
+            total["letter_grades"][letter] = total["letter_grades"].get(letter, 0) + count
+        if agg["most_open_seats"] is not None and (
+            total["most_open_seats"] is None or agg["most_open_seats"] > total["most_open_seats"]
+        ):
+            total["most_open_id"] = agg["most_open_id"]
+            total["most_open_seats"] = agg["most_open_seats"]
+    return total
+
+
+def build_aggregates(courses):
+    departments = {}
+    by_dept = {}
+    for course in courses:
+        dept = course["abbreviation"]
+        apply_course(departments.setdefault(dept, empty_aggregate()), course)
+        by_dept.setdefault(dept, []).append(course)
+    for dept, agg in departments.items():
+        _set_most_open(agg, by_dept[dept])
+    return {"departments": departments, "global": merge_aggregates(departments.values())}
+
+
+# Fold only the courses that changed between two snapshots into an existing table
+def update_aggregates(aggregates, old_courses, new_courses):
+    old_by_id = {c["id"]: c for c in old_courses}
+    new_by_id = {c["id"]: c for c in new_courses}
+    departments = aggregates["departments"]
+    touched = set()
+
+    for course_id, old in old_by_id.items():
+        new = new_by_id.get(course_id)
+        if new == old:
+            continue
+        apply_course(departments[old["abbreviation"]], old, -1)
+        touched.add(old["abbreviation"])
+    for course_id, new in new_by_id.items():
+        old = old_by_id.get(course_id)
+        if new == old:
+            continue
+        apply_course(departments.setdefault(new["abbreviation"], empty_aggregate()), new)
+        touched.add(new["abbreviation"])
+
+    if touched:
+        # Maxima can't be un-applied, so rescan just the departments that changed
+        touched_courses = {dept: [] for dept in touched}
+        for course in new_courses:
+            if course["abbreviation"] in touched_courses:
+                touched_courses[course["abbreviation"]].append(course)
+        for dept, dept_courses in touched_courses.items():
+            if dept_courses:
+                _set_most_open(departments[dept], dept_courses)
+            else:
+                departments.pop(dept, None)
+        aggregates["global"] = merge_aggregates(departments.values())
+
+    print(f"Updated aggregates for {len(touched)} departments with changed courses")
+    return aggregates
+
+
+def mean_enrolled(agg):
+    # Courses without an enrolledPercentage aren't in the sum; the histogram counts the rest
+    reported = sum(agg["enrolled_histogram"])
+    return agg["enrolled_sum"] / reported if reported else 0.0
+
+
+def mean_grade(agg):
+    return agg["grade_sum"] / agg["graded_courses"] if agg["graded_courses"] else None
+
+
+# Upper edge of the histogram bucket holding the q-th course, e.g. 0.55 for "<= 55%"
+def enrolled_percentile(agg, q):
+    total = sum(agg["enrolled_histogram"])
+    if not total:
+        return None
+    cumulative = 0
+    for i, count in enumerate(agg["enrolled_histogram"]):
+        cumulative += count
+        if cumulative >= q * total:
+            return (i + 1) / ENROLLED_BUCKETS
+    return 1.0
+
+
+def load_aggregates(path=AGGREGATES_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_aggregates(aggregates, path=AGGREGATES_FILE):
+    with open(path + ".tmp", "w") as f:
+        json.dump(aggregates, f, indent=2)
+    os.replace(path + ".tmp", path)
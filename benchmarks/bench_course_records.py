@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Compare snapshot courses kept as parsed dicts with Course records: snapshot load time
+# and resident memory per course, and building a response with json.dumps vs
+# render_response at the sizes query.py returns (handlers cap answers at 3-5 courses).
+# Usage: python benchmarks/bench_course_records.py [course_results.json]
+import json
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from course_record import Course, render_response
+
+DEPARTMENTS = ["COMPSCI", "MATH", "DATA", "EECS", "PHYSICS", "CHEM", "ECON", "HISTORY", "STAT", "MCELLBI"]
+LETTERS = ["A+", "A", "A-", "B+", "B", "B-", "C+", "C"]
+
+
+# Snapshot-shaped JSON for n courses, as fetch_courses.py writes it
+def synthetic_snapshot(n, rng):
+    nodes = []
+    for i in range(n):
+        graded = rng.random() < 0.8
+        nodes.append({"node": {
+            "id": f"Q291cnNlVHlwZTo{i}",
+            "abbreviation": rng.choice(DEPARTMENTS),
+            "courseNumber": f"{rng.randint(1, 299)}{rng.choice(['', 'A', 'B', 'C'])}",
+            "title": " ".join("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))).capitalize() for _ in range(rng.randint(2, 5))),
+            "openSeats": rng.randint(0, 300),
+            "enrolledPercentage": round(rng.random(), 4),
+            "units": rng.choice(["1.0", "2.0", "3.0", "4.0", "1.0 - 4.0"]),
+            "letterAverage": rng.choice(LETTERS) if graded else "",
+            "gradeAverage": round(rng.uniform(2.0, 4.0), 3) if graded else -1,
+        }})
+    return json.dumps(nodes)
+
+
+def load(raw, build, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(json.loads(raw))
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    courses = build(json.loads(raw))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return courses, size, best
+
+
+def per_response(render, responses):
+    start = time.perf_counter()
+    for picked in responses:
+        render("Courses with open seats: ...", picked)
+    return (time.perf_counter() - start) / len(responses)
+
+
+def bench(label, raw, rng):
+    dicts, dict_bytes, dict_load = load(raw, lambda entries: [e["node"] for e in entries])
+    records, record_bytes, record_load = load(raw, lambda entries: [Course(e["node"]) for e in entries])
+    assert render_response("x", records[:50]) == json.dumps({"text": "x", "courses": dicts[:50]})
+    n = len(dicts)
+    print(
+        f"{label:>16} | load: dicts {dict_load * 1e3:6.1f} ms, records {record_load * 1e3:6.1f} ms"
+        f" | resident: dicts {dict_bytes / n:4.0f} B/course, records {record_bytes / n:4.0f} B/course"
+    )
+    for size in (3, 5):
+        picks = [rng.sample(range(n), size) for _ in range(2000)]
+        old = per_response(
+            lambda text, courses: json.dumps({"text": text, "courses": courses}),
+            [[dicts[i] for i in p] for p in picks],
+        )
+        # Fresh records serialize on first render; repeats reuse the cached fragments
+        fresh = [Course(d) for d in dicts]
+        first = per_response(render_response, [[fresh[i] for i in p] for p in picks])
+        warm = per_response(render_response, [[fresh[i] for i in p] for p in picks])
+        print(
+            f"{label:>16} | {size} courses/response: json.dumps {old * 1e6:5.1f} us"
+            f" | render_response first {first * 1e6:5.1f} us, cached {warm * 1e6:5.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            raw = f.read()
+        bench(f"{len(json.loads(raw))} real", raw, rng)
+    for n in (1000, 10000, 50000):
+        bench(f"{n} synthetic", synthetic_snapshot(n, rng), rng)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Compare the old quoted-title substring loop in process_answer with TitleIndex:
+# speed, and precision on quotes that name a course vs quotes that name none.
+# Usage: python benchmarks/bench_title_match.py [course_results.json]
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from title_index import TitleIndex, normalize_title
+
+COMMON_WORDS = ["introduction", "advanced", "topics", "in", "of", "and", "the", "seminar", "special"]
+PREFIXES = ["Introduction to", "Topics in", "Advanced"]
+
+
+# The loop process_answer used before TitleIndex
+def substring_match(courses, clean_text):
+    best_match = None
+    best_match_ratio = 0
+    for course in courses:
+        title = course["title"]
+        if clean_text in title or title in clean_text:
+            ratio = len(clean_text) / max(len(clean_text), len(title))
+            if ratio > best_match_ratio:
+                best_match = course
+                best_match_ratio = ratio
+    return best_match if best_match_ratio > 0.5 else None
+
+
+# Titles mixing a few very common words with a large subject vocabulary, like a real catalog
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+
+def synthetic_courses(n, rng):
+    vocabulary = [random_word(rng) for _ in range(n // 2 + 100)]
+    courses = []
+    for _ in range(n):
+        words = [w.capitalize() for w in rng.sample(vocabulary, rng.randint(1, 3))]
+        if rng.random() < 0.3:
+            words.insert(0, rng.choice(PREFIXES))
+        elif rng.random() < 0.5:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(COMMON_WORDS))
+        courses.append({"title": " ".join(words)})
+    return courses
+
+
+# (quote, title it names or None) pairs. Named: exact titles, extra leading words and
+# dropped words, like LLM paraphrases. Unnamed: a catalog title with its last word
+# swapped for one no course uses, e.g. "Introduction to Probability" in a catalog
+# that only has "Introduction to Programming".
+def queries_for(courses, rng, count=200):
+    queries = []
+    for course in rng.sample(courses, min(count, len(courses))):
+        title = course["title"]
+        words = title.split()
+        choice = rng.random()
+        if choice < 0.25:
+            queries.append((title, title))
+        elif choice < 0.5:
+            queries.append(("Intro to " + title, title))
+        elif choice < 0.75:
+            queries.append((" ".join(words[1:] or words), title))
+        else:
+            queries.append((" ".join(words[:-1] + [random_word(rng).capitalize()]), None))
+    return queries
+
+
+def score(matches, queries):
+    hits = correct = false = 0
+    for match, (_, expected) in zip(matches, queries):
+        if match is None:
+            continue
+        hits += 1
+        if expected is not None and normalize_title(match["title"]) == normalize_title(expected):
+            correct += 1
+        else:
+            false += 1
+    return hits, correct, false
+
+
+def bench(label, courses, queries):
+    start = time.perf_counter()
+    index = TitleIndex(courses)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    old_matches = [substring_match(courses, q) for q, _ in queries]
+    old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_matches = [next((c for c, _ in index.search(q, limit=1)), None) for q, _ in queries]
+    new = time.perf_counter() - start
+
+    named = sum(expected is not None for _, expected in queries)
+    per_old = old / len(queries) * 1e6
+    per_new = new / len(queries) * 1e6
+    for name, per_query, matches in (("substring", per_old, old_matches), ("trigram", per_new, new_matches)):
+        hits, correct, false = score(matches, queries)
+        print(
+            f"{label:>18} | {name:>9} {per_query:9.1f} us/q | {correct:4d}/{named} named quotes found"
+            f" | {false:4d} wrong matches | precision {correct / hits if hits else 1.0:5.1%}"
+        )
+    print(f"{label:>18} | build {build * 1e3:8.1f} ms | {per_old / per_new:6.1f}x")
+
+    # process_answer's "titles mentioned in the answer" pass: the old scan vs titles_in()
+    answers = [
+        f"You might like {rng.choice(courses)['title']}, which covers the basics, or {rng.choice(courses)['title']}."
+        " Both are offered this term and fill up quickly, so enroll early if you are interested."
+        for _ in range(100)
+    ]
+    start = time.perf_counter()
+    for answer in answers:
+        [c for c in courses if len(c["title"]) >= 5 and c["title"] in answer]
+    old = (time.perf_counter() - start) / len(answers) * 1e6
+    start = time.perf_counter()
+    for answer in answers:
+        [c for c in index.titles_in(answer) if len(c["title"]) >= 5 and c["title"] in answer]
+    new = (time.perf_counter() - start) / len(answers) * 1e6
+    print(f"{label:>18} | titles in answer: scan {old:9.1f} us, titles_in {new:7.1f} us | {old / new:6.1f}x")
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            courses = [e.get("node", e) for e in json.load(f)]
+        bench(f"{len(courses)} real", courses, queries_for(courses, rng))
+    for n in (1000, 10000, 50000):
+        courses = synthetic_courses(n, rng)
+        bench(f"{n} synthetic", courses, queries_for(courses, rng))
@@ -4,10 +4,13 @@ from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from docstore import save_index
+from shards import load_shards, select_shards, update_manifest
 
-def build_index():
+# Build one shard's index from its snapshot
+def build_index(shard):
     # 1. Load the raw JSON array of {"node": {...}} objects
-    with open("course_results.json", "r", encoding="utf-8") as f:
+    with open(shard["snapshot"], "r", encoding="utf-8") as f:
         raw = json.load(f)
 
     # 2. Convert each node to a Document with string content
@@ -29,9 +32,13 @@ def build_index():
     embeddings = OpenAIEmbeddings()
     db = FAISS.from_documents(chunks, embeddings)
 
-    # 5. Save index locally
-    db.save_local("faiss_index")
-    print(f"✅ Built index with {len(chunks)} chunks → saved to faiss_index/")
+    # 5. Save index locally (raw FAISS vectors + sqlite docstore, no pickle)
+    manifest = save_index(db, shard["index"])
+    update_manifest(shard, build_id=manifest["build_id"], built_at=manifest["built_at"], chunks=len(chunks))
+    print(f"✅ Built index with {len(chunks)} chunks → saved to {shard['index']}/")
 
+# python build_index.py [--shard <id> ...]  (defaults to every shard in shards.json)
 if __name__ == "__main__":
-    build_index()
+    _, shards = load_shards()
+    for shard in select_shards(shards):
+        build_index(shard)
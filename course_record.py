@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import json
+import sys
+
+# Fields fetch_courses.py asks Berkeleytime for, in snapshot order
+COURSE_FIELDS = (
+    "id",
+    "abbreviation",
+    "courseNumber",
+    "title",
+    "openSeats",
+    "enrolledPercentage",
+    "units",
+    "letterAverage",
+    "gradeAverage",
+)
+# Short strings shared by many courses; interned so every worker keeps one copy each
+_INTERNED = ("abbreviation", "units", "letterAverage")
+
+_MISSING = object()
+
+
+class Course:
+    """Compact, read-only course record that still reads like the snapshot's node dicts.
+
+    `fragment` is the course's JSON, serialized the first time a response includes it
+    and reused after that. Loading a snapshot never serializes anything.
+    """
+
+    __slots__ = COURSE_FIELDS + ("_fragment",)
+
+    def __init__(self, node):
+        # Slot descriptors set directly: one record per course is built on every snapshot load
+        get = node.get
+        for field, set_field in _SETTERS:
+            set_field(self, get(field, _MISSING))
+        for field, set_field in _INTERNED_SETTERS:
+            value = get(field)
+            if isinstance(value, str):
+                set_field(self, sys.intern(value))
+        _SET_FRAGMENT(self, None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Course records are immutable; reload the snapshot instead")
+
+    def __getitem__(self, field):
+        value = getattr(self, field, _MISSING) if field in COURSE_FIELDS else _MISSING
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __contains__(self, field):
+        return field in COURSE_FIELDS and getattr(self, field) is not _MISSING
+
+    def keys(self):
+        return [field for field in COURSE_FIELDS if getattr(self, field) is not _MISSING]
+
+    @property
+    def fragment(self):
+        # Fields serialize in snapshot order, so this matches json.dumps of the node dict
+        if self._fragment is None:
+            _SET_FRAGMENT(self, json.dumps({field: getattr(self, field) for field in self.keys()}))
+        return self._fragment
+
+    def __repr__(self):
+        return f"Course({self.fragment})"
+
+
+_SETTERS = [(field, getattr(Course, field).__set__) for field in COURSE_FIELDS]
+_INTERNED_SETTERS = [(field, getattr(Course, field).__set__) for field in _INTERNED]
+_SET_FRAGMENT = Course._fragment.__set__
+
+
+# {"text": ..., "courses": [...]} built from cached fragments; same bytes json.dumps would give
+def render_response(text, courses):
+    return '{"text": ' + json.dumps(text) + ', "courses": [' + ", ".join(c.fragment for c in courses) + "]}"
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections.abc import Mapping
+
+import faiss
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+# On-disk layout of a saved index folder:
+#   index-<build_id>.faiss      raw FAISS vectors (faiss.write_index, no pickle)
+#   docstore-<build_id>.sqlite  one row per vector: position -> docstore id, text, metadata
+#   manifest.json               build id, file names + counts, swapped in last
+# Files are never rewritten in place: readers load exactly the pair the manifest names,
+# so a build landing mid-load can't pair new docstore rows with old FAISS positions.
+INDEX_FILE = "index-{build_id}.faiss"
+DOCSTORE_FILE = "docstore-{build_id}.sqlite"
+MANIFEST_FILE = "manifest.json"
+
+
+# Write the docstore rows for every vector in a freshly built FAISS store
+def write_docstore(db, path):
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute(
+        "CREATE TABLE docs ("
+        " position INTEGER PRIMARY KEY,"
+        " doc_id TEXT NOT NULL UNIQUE,"
+        " page_content TEXT NOT NULL,"
+        " metadata TEXT NOT NULL)"
+    )
+    rows = []
+    for position, doc_id in db.index_to_docstore_id.items():
+        doc = db.docstore.search(doc_id)
+        rows.append((position, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+    conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    # Swap in atomically so a reader never sees a half-written file
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+# Save a FAISS store as a new index/docstore pair (replaces FAISS.save_local)
+def save_index(db, folder):
+    os.makedirs(folder, exist_ok=True)
+    previous = read_manifest(folder) if os.path.exists(os.path.join(folder, MANIFEST_FILE)) else None
+
+    # Every build gets a fresh id so caches keyed on it invalidate themselves
+    build_id = uuid.uuid4().hex
+    docstore_file = DOCSTORE_FILE.format(build_id=build_id)
+    index_file = INDEX_FILE.format(build_id=build_id)
+    count = write_docstore(db, os.path.join(folder, docstore_file))
+
+    index_path = os.path.join(folder, index_file)
+    faiss.write_index(db.index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+    manifest = {
+        "build_id": build_id,
+        "built_at": time.time(),
+        "chunks": count,
+        "index": index_file,
+        "docstore": docstore_file,
+    }
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Keep the previous build for readers that already read its manifest; drop anything older
+    keep = {MANIFEST_FILE, index_file, docstore_file}
+    if previous:
+        keep.update((previous.get("index"), previous.get("docstore")))
+    for name in os.listdir(folder):
+        if name not in keep and name.startswith(("index", "docstore")) and not name.endswith(".tmp"):
+            os.remove(os.path.join(folder, name))
+    return manifest
+
+
+def read_manifest(folder):
+    with open(os.path.join(folder, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def _connect(path):
+    # Read-only and shareable across threads; every lookup is a single indexed row
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+
+class SqliteDocstore(Docstore):
+    """Docstore that reads documents from sqlite on demand instead of unpickling them all."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = _connect(path)
+
+    def search(self, search):
+        row = self._conn.execute(
+            "SELECT page_content, metadata FROM docs WHERE doc_id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def search_positions(self, positions):
+        # Hydrate documents straight from FAISS result positions, keeping their order
+        positions = [int(p) for p in positions if p != -1]
+        if not positions:
+            return []
+        placeholders = ",".join("?" * len(positions))
+        rows = self._conn.execute(
+            f"SELECT position, page_content, metadata FROM docs WHERE position IN ({placeholders})",
+            positions,
+        ).fetchall()
+        by_position = {r[0]: Document(page_content=r[1], metadata=json.loads(r[2])) for r in rows}
+        return [by_position[p] for p in positions if p in by_position]
+
+    def close(self):
+        self._conn.close()
+
+
+class SqliteIndexToDocstoreId(Mapping):
+    """Lazy stand-in for FAISS.index_to_docstore_id backed by the docstore table."""
+
+    def __init__(self, docstore):
+        self._conn = docstore._conn
+
+    def __getitem__(self, position):
+        row = self._conn.execute(
+            "SELECT doc_id FROM docs WHERE position = ?", (int(position),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self):
+        for (position,) in self._conn.execute("SELECT position FROM docs ORDER BY position"):
+            yield position
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+
+# Open the build a manifest names without deserializing the docstore; documents load
+# per search hit. Pass the manifest already read so its build id matches what's loaded.
+def load_index(folder, embeddings, manifest=None):
+    manifest = manifest or read_manifest(folder)
+    index = faiss.read_index(os.path.join(folder, manifest["index"]))
+    docstore = SqliteDocstore(os.path.join(folder, manifest["docstore"]))
+    return FAISS(
+        embeddings,
+        index,
+        docstore,
+        SqliteIndexToDocstoreId(docstore),
+    )
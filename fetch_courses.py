@@ -2,7 +2,10 @@
 import os
 import requests
 import json
+import time
 from dotenv import load_dotenv
+from aggregates import build_aggregates, load_aggregates, save_aggregates, snapshot_hash, update_aggregates
+from shards import ensure_parent, load_shards, select_shards, update_manifest
 
 load_dotenv()  # loads BT_CSRFTOKEN from .env
 
@@ -32,11 +35,13 @@ query GetCoursesForFilter($playlists: String!) {
   }
 }
 """,
-    "variables": {"playlists": "UGxheWxpc3RUeXBlOjMyNTY1"}
 }
 
-def fetch():
-    resp = requests.post(ENDPOINT, headers=HEADERS, json=PAYLOAD)
+# Fetch one shard's playlist (term/campus) into its own snapshot + aggregates
+def fetch(shard):
+    print(f"Fetching shard {shard['id']} (playlist {shard['playlist']})")
+    payload = dict(PAYLOAD, variables={"playlists": shard["playlist"]})
+    resp = requests.post(ENDPOINT, headers=HEADERS, json=payload)
     resp.raise_for_status()
     edges = resp.json()["data"]["allCourses"]["edges"]
     
@@ -47,12 +52,39 @@ def fetch():
     print(f"Filtered out {original_count - filtered_count} courses with openSeats = -1")
     print(f"Keeping {filtered_count} courses with valid open seats")
 
+    # Keep the previous snapshot around so aggregates only re-apply what changed
+    previous_courses = None
+    previous_hash = None
+    if os.path.exists(shard["snapshot"]):
+        with open(shard["snapshot"], "rb") as f:
+            raw = f.read()
+        previous_courses = [e["node"] for e in json.loads(raw)]
+        previous_hash = snapshot_hash(raw)
+
     # persist to JSON file
-    with open("course_results.json", "w") as f:
-        json.dump(filtered_edges, f, indent=2)
+    ensure_parent(shard["snapshot"])
+    snapshot = json.dumps(filtered_edges, indent=2)
+    with open(shard["snapshot"], "w") as f:
+        f.write(snapshot)
+
+    # Materialize per-department + global aggregates next to the snapshot; an existing
+    # table is only updated incrementally if it describes the snapshot being replaced
+    courses = [edge["node"] for edge in filtered_edges]
+    aggregates = load_aggregates(shard["aggregates"])
+    if aggregates is not None and previous_courses is not None and aggregates.get("snapshot_sha256") == previous_hash:
+        aggregates = update_aggregates(aggregates, previous_courses, courses)
+    else:
+        aggregates = build_aggregates(courses)
+    aggregates["snapshot_sha256"] = snapshot_hash(snapshot.encode("utf-8"))
+    ensure_parent(shard["aggregates"])
+    save_aggregates(aggregates, shard["aggregates"])
+    update_manifest(shard, courses=len(courses), fetched_at=time.time())
 
     # print pretty JSON for logging
     print(json.dumps(filtered_edges, indent=2))
 
+# python fetch_courses.py [--shard <id> ...]  (defaults to every shard in shards.json)
 if __name__ == "__main__":
-    fetch()
+    _, shards = load_shards()
+    for shard in select_shards(shards):
+        fetch(shard)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Where processes merge their metrics so short-lived query.py runs add up
+METRICS_FILE = os.getenv("CALGPT_METRICS_FILE", "metrics.json")
+METRICS_ENABLED = os.getenv("CALGPT_METRICS", "1") != "0"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+
+_lock = threading.Lock()
+
+
+class Counter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = {}
+
+    def inc(self, label_value, amount=1):
+        with _lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def merge(self, data):
+        for label_value, value in data.items():
+            self.values[label_value] = self.values.get(label_value, 0) + value
+
+    def dump(self):
+        return dict(self.values)
+
+    def prometheus(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+    def summary(self):
+        return dict(sorted(self.values.items()))
+
+
+class Histogram:
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> [per-bucket counts (+Inf last), count, sum]
+        self.values = {}
+
+    def observe(self, label_value, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            entry = self.values.get(label_value)
+            if entry is None:
+                entry = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def merge(self, data):
+        for label_value, (counts, count, total) in data.items():
+            entry = self.values.get(label_value)
+            if entry is None:
+                entry = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += count
+            entry[2] += total
+
+    def dump(self):
+        return {k: [list(v[0]), v[1], v[2]] for k, v in self.values.items()}
+
+    def prometheus(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, count, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {count}')
+        return lines
+
+    def quantile(self, label_value, q):
+        # Upper bound of the bucket holding the q-th observation
+        counts, count, _ = self.values[label_value]
+        target = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            label_value: {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else 0.0,
+                "p50": self.quantile(label_value, 0.5),
+                "p95": self.quantile(label_value, 0.95),
+            }
+            for label_value, (_, count, total) in sorted(self.values.items())
+        }
+
+
+BRANCH_REQUESTS = Counter(
+    "calgpt_branch_requests_total", "Questions handled per answer_with_context branch", "branch"
+)
+STAGE_SECONDS = Histogram(
+    "calgpt_stage_seconds", "Latency of each pipeline stage in seconds", "stage", LATENCY_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "calgpt_llm_tokens", "Tokens used per LLM call", "kind", TOKEN_BUCKETS
+)
+SEMANTIC_CACHE = Counter(
+    "calgpt_semantic_cache_total", "Semantic answer cache lookups by outcome", "outcome"
+)
+SHARD_REQUESTS = Counter(
+    "calgpt_shard_requests_total", "Questions answered per term/campus shard", "shard"
+)
+COUNTERS = {"branch_requests": BRANCH_REQUESTS, "semantic_cache": SEMANTIC_CACHE, "shard_requests": SHARD_REQUESTS}
+HISTOGRAMS = {"stage_seconds": STAGE_SECONDS, "llm_tokens": LLM_TOKENS}
+
+
+def record_branch(branch):
+    if METRICS_ENABLED:
+        BRANCH_REQUESTS.inc(branch)
+
+
+def record_shard(shard_id):
+    if METRICS_ENABLED:
+        SHARD_REQUESTS.inc(shard_id)
+
+
+def record_semantic_cache(outcome):
+    if METRICS_ENABLED:
+        SEMANTIC_CACHE.inc(outcome)
+
+
+@contextmanager
+def timed(stage):
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(stage, time.perf_counter() - start)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times LLM and retriever runs and records token usage reported by the LLM."""
+
+    def __init__(self):
+        self._starts = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        if METRICS_ENABLED:
+            self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if not METRICS_ENABLED:
+            return
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            STAGE_SECONDS.observe("llm", time.perf_counter() - start)
+        usage = (response.llm_output or {}).get("token_usage", {})
+        for kind in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if kind in usage:
+                LLM_TOKENS.observe(kind, usage[kind])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        if METRICS_ENABLED:
+            self._starts[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            STAGE_SECONDS.observe("retrieval", time.perf_counter() - start)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+
+def _all_metrics():
+    return [("counters", COUNTERS), ("histograms", HISTOGRAMS)]
+
+
+def dump():
+    with _lock:
+        return {kind: {key: m.dump() for key, m in group.items()} for kind, group in _all_metrics()}
+
+
+# Dump and zero everything in one step so no observation is lost or counted twice
+def take():
+    with _lock:
+        data = {kind: {key: m.dump() for key, m in group.items()} for kind, group in _all_metrics()}
+        for _, group in _all_metrics():
+            for m in group.values():
+                m.values = {}
+    return data
+
+
+def load(data):
+    with _lock:
+        for kind, group in _all_metrics():
+            for key, values in data.get(kind, {}).items():
+                if key in group:
+                    group[key].merge(values)
+
+
+# Merge this process's metrics into METRICS_FILE and start counting from zero again
+def flush(path=METRICS_FILE):
+    data = take()
+    if not any(any(v for v in group.values()) for group in data.values()):
+        return
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        raw = f.read()
+        stored = json.loads(raw) if raw else {}
+        for kind, group in data.items():
+            stored_group = stored.setdefault(kind, {})
+            for key, values in group.items():
+                target = stored_group.setdefault(key, {})
+                for label_value, value in values.items():
+                    if kind == "counters":
+                        target[label_value] = target.get(label_value, 0) + value
+                    elif label_value in target:
+                        old = target[label_value]
+                        target[label_value] = [[a + b for a, b in zip(old[0], value[0])], old[1] + value[1], old[2] + value[2]]
+                    else:
+                        target[label_value] = value
+        f.seek(0)
+        f.truncate()
+        json.dump(stored, f)
+
+
+def start_flusher(interval=30):
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+    threading.Thread(target=run, name="metrics-flusher", daemon=True).start()
+
+
+def prometheus_text():
+    lines = []
+    for _, group in _all_metrics():
+        for m in group.values():
+            lines.extend(m.prometheus())
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    return {key: m.summary() for _, group in _all_metrics() for key, m in group.items()}
+
+
+if METRICS_ENABLED:
+    atexit.register(flush)
+
+
+# Print the accumulated metrics: Prometheus text by default, --json for a summary
+if __name__ == "__main__":
+    atexit.unregister(flush)
+    if os.path.exists(METRICS_FILE):
+        with open(METRICS_FILE) as f:
+            load(json.load(f))
+    if "--json" in sys.argv:
+        print(json.dumps(summary(), indent=2))
+    else:
+        sys.stdout.write(prometheus_text())
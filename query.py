@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
+import contextvars
+import hashlib
 import json
 import re
 import requests
 import sys
-from langchain_community.vectorstores import FAISS
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.llms import OpenAI
 from langchain.chains import RetrievalQA
@@ -12,58 +15,222 @@ from langchain.memory import ConversationBufferMemory
 from langchain.prompts import ChatPromptTemplate
 import os
 from dotenv import load_dotenv
+from docstore import load_index, read_manifest
+from retrieval_cache import CachedRetriever, RetrievalCache
+from reload_manager import ReloadManager
+from shards import ShardCache, load_shards, route
+from title_index import MIN_SCORE, TitleIndex
+from course_record import Course, render_response
+from aggregates import build_aggregates, enrolled_percentile, mean_enrolled, mean_grade, merge_aggregates, snapshot_hash
+from semantic_cache import MemoizedEmbeddings, SemanticCache
+from metrics import MetricsCallbackHandler, record_branch, record_semantic_cache, record_shard, start_flusher, timed
 
 load_dotenv()
 
-# 1) Fetch data from GitHub Pages
-DATA_URL = "https://masonarditi.github.io/calgpt-2025/course_results.json"
-resp = requests.get(DATA_URL)
-resp.raise_for_status()
-courses = [e["node"] for e in resp.json()]
-
-# 2) Load FAISS index & QA chain
-emb = OpenAIEmbeddings()
-db = FAISS.load_local(
-    "faiss_index",
-    emb,
-    allow_dangerous_deserialization=True
-)
-
-# Creating a chat-aware QA system
+# Each shard (term/campus) has its own snapshot URL, aggregates and index; see shards.json
+campuses, shards = load_shards()
+# How often a persistent process checks for a new snapshot or index build
+RELOAD_INTERVAL = float(os.getenv("CALGPT_RELOAD_INTERVAL", "60"))
+# Seconds to wait on GitHub Pages; a stalled fetch must not hold a shard's reload lock forever
+FETCH_TIMEOUT = float(os.getenv("CALGPT_FETCH_TIMEOUT", "10"))
+
+# Memoized so the answer cache and the retriever embed each question once
+emb = MemoizedEmbeddings(OpenAIEmbeddings())
+metrics_handler = MetricsCallbackHandler()
 llm = OpenAI(temperature=0)
-qa = RetrievalQA.from_chain_type(
-    llm=llm,
-    chain_type="stuff",
-    retriever=db.as_retriever()
-)
 
-# Get all unique department abbreviations
-dept_abbreviations = set(course["abbreviation"] for course in courses)
-print(f"Loaded {len(courses)} courses with {len(dept_abbreviations)} departments")
+# The published snapshot's ETag plus the index build id identify one generation
+def snapshot_version(resp):
+    return resp.headers.get("ETag") or resp.headers.get("Last-Modified") or hashlib.sha256(resp.content).hexdigest()
+
+def probe_versions(shard):
+    resp = requests.head(shard["data_url"], timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    if not (resp.headers.get("ETag") or resp.headers.get("Last-Modified")):
+        resp = requests.get(shard["data_url"], timeout=FETCH_TIMEOUT)
+        resp.raise_for_status()
+    return (snapshot_version(resp), read_manifest(shard["index"])["build_id"])
+
+# Build everything a request needs for one shard's snapshot + index version
+def load_generation(shard):
+    # 1) Fetch data from GitHub Pages
+    with timed("catalog_load"):
+        resp = requests.get(shard["data_url"], timeout=FETCH_TIMEOUT)
+        resp.raise_for_status()
+        # Slotted records; each course's JSON is serialized once, when first returned
+        courses = [Course(e["node"]) for e in resp.json()]
+
+    # 2) Load FAISS index & QA chain
+    with timed("faiss_load"):
+        manifest = read_manifest(shard["index"])
+        build_id = manifest["build_id"]
+        db = load_index(shard["index"], emb, manifest)
+    retrieval_cache = RetrievalCache(build_id, path=shard["retrieval_cache"])
+
+    # Creating a chat-aware QA system
+    qa = RetrievalQA.from_chain_type(
+        llm=llm,
+        chain_type="stuff",
+        retriever=CachedRetriever(vectorstore=db, cache=retrieval_cache)
+    )
+
+    # Get all unique department abbreviations
+    dept_abbreviations = set(course["abbreviation"] for course in courses)
+    print(f"Loaded {len(courses)} courses with {len(dept_abbreviations)} departments for {shard['id']}", file=sys.stderr)
+
+    # Direct lookups so aggregate answers don't rescan the catalog
+    courses_by_id = {course["id"]: course for course in courses}
+    courses_by_dept = {}
+    for course in courses:
+        courses_by_dept.setdefault(course["abbreviation"], []).append(course)
+
+    # Rough resident size for the shard cache: raw vectors plus the parsed catalog,
+    # which takes a few times its JSON size as course records
+    resident_bytes = db.index.ntotal * db.index.d * 4 + len(resp.content) * 4
+
+    return (snapshot_version(resp), build_id), {
+        "shard": shard,
+        "build_id": build_id,
+        "snapshot_sha256": snapshot_hash(resp.content),
+        "resident_bytes": resident_bytes,
+        "courses": courses,
+        "dept_abbreviations": dept_abbreviations,
+        "courses_by_id": courses_by_id,
+        "courses_by_dept": courses_by_dept,
+        "db": db,
+        "retrieval_cache": retrieval_cache,
+        "qa": qa,
+    }
+
+# Called once a replaced generation has no requests left running on it
+def close_generation(generation):
+    generation.db.docstore.close()
+    generation.retrieval_cache.close()
+    if "semantic_cache" in generation.state:
+        generation.semantic_cache.close()
+
+def open_shard(shard):
+    return ReloadManager(
+        lambda: load_generation(shard),
+        lambda: probe_versions(shard),
+        close_generation,
+        RELOAD_INTERVAL,
+    )
+
+# Only recently used shards stay resident (CALGPT_SHARD_CACHE_MB / CALGPT_SHARD_CACHE_MAX)
+shard_cache = ShardCache(open_shard, lambda manager: manager.current.resident_bytes)
+
+# The generation pinned by the request running in this context
+_generation = contextvars.ContextVar("generation", default=None)
+
+def current():
+    return _generation.get() or shard_cache.manager(shards[0]).current
+
+# Department + global aggregates, fetched on first use. fetch_courses.py publishes them
+# with each snapshot; compute them here if they can't be fetched or describe another snapshot.
+def current_aggregates():
+    generation = current()
+    if "aggregates" not in generation.state:
+        aggregates = None
+        with timed("aggregates_load"):
+            try:
+                resp = requests.get(generation.shard["aggregates_url"], timeout=FETCH_TIMEOUT)
+                if resp.ok:
+                    aggregates = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                print(f"[DEBUG] Couldn't fetch aggregates, computing them locally: {e}")
+            if not aggregates or aggregates.get("snapshot_sha256") != generation.snapshot_sha256:
+                aggregates = build_aggregates(generation.courses)
+        generation.state["aggregates"] = aggregates
+    return generation.state["aggregates"]
+
+# Stored QA answers, opened on the first QA-branch lookup: loading them reads every cached
+# vector, which grade/seat/aggregate questions never need. Valid for one index build;
+# course data is re-hydrated per snapshot.
+def current_semantic_cache():
+    generation = current()
+    if "semantic_cache" not in generation.state:
+        with timed("semantic_cache_load"):
+            cache = SemanticCache(generation.build_id, path=generation.shard["semantic_cache"])
+        # Another worker may have opened it meanwhile; keep theirs
+        if generation.state.setdefault("semantic_cache", cache) is not cache:
+            cache.close()
+    return generation.state["semantic_cache"]
+
+# Words before "courses"/"classes" that widen the scope rather than name a department
+CATALOG_SCOPE_WORDS = {"all", "every", "the", "these", "open", "available", "of", "in", "across", "catalog", "total"}
+
+# Title index for the quoted/mentioned-title fallbacks, built on first use: most
+# questions never reach them and building it costs tens of ms on a full catalog
+def current_title_index():
+    generation = current()
+    if "title_index" not in generation.state:
+        with timed("title_index_build"):
+            generation.state["title_index"] = TitleIndex(generation.courses)
+    return generation.state["title_index"]
 
 # 3) Numeric handlers
 def most_open_seats():
-    c = max(courses, key=lambda c: c["openSeats"])
-    result = json.dumps({
-        "text": f"{c['abbreviation']} {c['courseNumber']} – {c['openSeats']} open seats",
-        "courses": [c]
-    })
+    aggregates = current_aggregates()
+    c = current().courses_by_id.get(aggregates["global"]["most_open_id"])
+    if c is None:
+        c = max(current().courses, key=lambda c: c["openSeats"])
+    result = render_response(
+        f"{c['abbreviation']} {c['courseNumber']} – {c['openSeats']} open seats",
+        [c]
+    )
     print(f"[DEBUG] most_open_seats returning: {result[:100]}...")
     return result
 
 def avg_enrolled(dept=None):
-    subset = [c for c in courses if not dept or c["abbreviation"] == dept]
-    vals = [c["enrolledPercentage"] for c in subset]
-    avg = sum(vals)/len(vals)
-    result = json.dumps({
-        "text": f"Average enrolled% = {avg:.2%}",
-        "courses": subset[:5] if subset else []  # Return up to 5 example courses
-    })
+    aggregates = current_aggregates()
+    agg = aggregates["departments"].get(dept) if dept else aggregates["global"]
+    if not agg:
+        return render_response(f"I couldn't find any {dept} courses.", [])
+    subset = current().courses_by_dept.get(dept, []) if dept else current().courses
+    avg = mean_enrolled(agg)
+    result = render_response(
+        f"Average enrolled% = {avg:.2%}",
+        subset[:5] if subset else []  # Return up to 5 example courses
+    )
     print(f"[DEBUG] avg_enrolled returning: {result[:100]}...")
     return result
 
+# Aggregate stats (seat totals, grade distribution, enrollment percentiles) for departments
+def department_stats(depts=None):
+    aggregates = current_aggregates()
+    if depts:
+        parts = [aggregates["departments"][d] for d in depts if d in aggregates["departments"]]
+        if not parts:
+            return render_response(f"I couldn't find any {', '.join(depts)} courses.", [])
+        agg = merge_aggregates(parts)
+        label = ", ".join(d for d in depts if d in aggregates["departments"])
+    else:
+        agg = aggregates["global"]
+        label = "All departments"
+
+    text = f"{label}: {agg['courses']} courses with {agg['open_seats']} open seats in total."
+    text += f" Average enrolled {mean_enrolled(agg):.2%}"
+    median, p90 = enrolled_percentile(agg, 0.5), enrolled_percentile(agg, 0.9)
+    if median is not None:
+        text += f", median under {median:.0%}, 90th percentile under {p90:.0%}"
+    text += "."
+    avg_grade = mean_grade(agg)
+    if avg_grade is not None:
+        grades = ", ".join(f"{letter}: {count}" for letter, count in sorted(agg["letter_grades"].items()))
+        text += f" Average grade {avg_grade:.2f} across {agg['graded_courses']} graded courses ({grades})."
+
+    most_open = current().courses_by_id.get(agg["most_open_id"])
+    result = render_response(
+        text,
+        [most_open] if most_open else []
+    )
+    print(f"[DEBUG] department_stats returning: {result[:100]}...")
+    return result
+
 # Function to find courses by grade criteria
 def find_courses_by_grade(min_grade, grade_format='letter', exact_match=False):
+    courses = current().courses
     print(f"[DEBUG] Finding courses with {'exact' if exact_match else 'minimum'} grade: {min_grade}, format: {grade_format}")
     
     grade_courses = []
@@ -133,12 +300,14 @@ def find_courses_by_grade(min_grade, grade_format='letter', exact_match=False):
 
 # Function to find courses by department
 def find_courses_by_dept(dept_name):
+    courses = current().courses
     dept_courses = [course for course in courses if course["abbreviation"] == dept_name and course["openSeats"] > 0][:3]
     print(f"[DEBUG] Found {len(dept_courses)} courses for department {dept_name}")
     return dept_courses
 
 # Function to find course by ID
 def find_course_by_id(course_id):
+    courses = current().courses
     for course in courses:
         if course["id"] == course_id:
             print(f"[DEBUG] Found course for ID {course_id}: {course['abbreviation']} {course['courseNumber']}")
@@ -146,8 +315,17 @@ def find_course_by_id(course_id):
     print(f"[DEBUG] No course found for ID {course_id}")
     return None
 
+# Function to find courses whose titles best match some text (answer snippets or user questions)
+def find_courses_by_title(text, limit=5, min_score=MIN_SCORE):
+    matches = current_title_index().search(text, limit=limit, min_score=min_score)
+    for course, score in matches:
+        print(f"[DEBUG] Title match {score:.2f}: {course['abbreviation']} {course['courseNumber']} - {course['title']}")
+    return [course for course, _ in matches]
+
 # Process answer for course IDs and department names
 def process_answer(answer, question, requested_subject=None):
+    courses = current().courses
+    dept_abbreviations = current().dept_abbreviations
     print(f"[DEBUG] Processing answer: {answer[:50]}...")
     
     # If we have a specific requested subject, prioritize those courses
@@ -198,10 +376,10 @@ def process_answer(answer, question, requested_subject=None):
             
             # If we found courses from the requested subject, return them
             if found_courses:
-                result = json.dumps({
-                    "text": answer,
-                    "courses": found_courses[:5]  # Limit to 5 courses
-                })
+                result = render_response(
+                    answer,
+                    found_courses[:5]  # Limit to 5 courses
+                )
                 print(f"[DEBUG] Returning {len(found_courses[:5])} courses based on requested subject")
                 return result
     
@@ -281,10 +459,10 @@ def process_answer(answer, question, requested_subject=None):
                 if available_math_courses:
                     print(f"[DEBUG] Found {len(available_math_courses)} math courses with open seats")
                     found_courses = available_math_courses[:5]  # Limit to 5 courses
-                    return json.dumps({
-                        "text": f"Available math courses with open seats: " + ", ".join([f"{c['abbreviation']} {c['courseNumber']}" for c in found_courses]),
-                        "courses": found_courses
-                    })
+                    return render_response(
+                        f"Available math courses with open seats: " + ", ".join([f"{c['abbreviation']} {c['courseNumber']}" for c in found_courses]),
+                        found_courses
+                    )
             
             # If we have target departments, prioritize them
             if target_depts:
@@ -312,8 +490,8 @@ def process_answer(answer, question, requested_subject=None):
         # If still no courses found, try to match by title
         if not found_courses:
             print("[DEBUG] Checking for course titles in the answer")
-            # Look for course titles in the answer
-            for course in courses:
+            # Look for course titles in the answer; the index finds them case-insensitively
+            for course in current_title_index().titles_in(answer):
                 title = course["title"]
                 # Only check titles with at least 5 characters to avoid too many false positives
                 if len(title) >= 5 and title in answer:
@@ -336,21 +514,12 @@ def process_answer(answer, question, requested_subject=None):
                     if len(clean_text) < 5:  # Skip very short titles
                         continue
                         
-                    # Find the most similar course title
-                    best_match = None
-                    best_match_ratio = 0
-                    
-                    for course in courses:
-                        title = course["title"]
-                        # Simple substring match first
-                        if clean_text in title or title in clean_text:
-                            ratio = len(clean_text) / max(len(clean_text), len(title))
-                            if ratio > best_match_ratio:
-                                best_match = course
-                                best_match_ratio = ratio
+                    # Find the course whose title contains (or is contained in) the quote, else a close match
+                    best_matches = find_courses_by_title(clean_text, limit=1)
                     
                     # If we found a good match, add it
-                    if best_match_ratio > 0.5:  # At least 50% similar
+                    if best_matches:
+                        best_match = best_matches[0]
                         print(f"[DEBUG] Found course by quoted title: {best_match['abbreviation']} {best_match['courseNumber']} - {best_match['title']}")
                         if best_match not in found_courses:
                             found_courses.append(best_match)
@@ -358,10 +527,10 @@ def process_answer(answer, question, requested_subject=None):
                             break
     
     # Always return as JSON
-    result = json.dumps({
-        "text": answer,
-        "courses": found_courses
-    })
+    result = render_response(
+        answer,
+        found_courses
+    )
     print(f"[DEBUG] process_answer returning {len(found_courses)} courses, JSON length: {len(result)}")
     return result
 
@@ -415,8 +584,92 @@ def extract_subject_from_question(question):
     
     return None
 
+# Course ids shown in a JSON response, so cached answers can be re-hydrated later
+def response_course_ids(response):
+    try:
+        return [c["id"] for c in json.loads(response).get("courses", [])]
+    except (ValueError, AttributeError, TypeError):
+        return []
+
+# Swap a cached response's courses for the current records (fresh seat counts)
+def rehydrate(entry):
+    if not entry["course_ids"]:
+        return entry["response"]
+    parsed = json.loads(entry["response"])
+    courses_by_id = current().courses_by_id
+    return render_response(parsed["text"], [courses_by_id[i] for i in entry["course_ids"] if i in courses_by_id])
+
+# Reuse a stored QA answer for a paraphrased question instead of running `compute`
+def semantic_cached(question, chat_history, compute, subject=None):
+    # Follow-ups depend on the conversation, so only standalone questions are shared
+    if chat_history:
+        return compute()
+
+    # Keyed by subject too: "open CS classes" must never reuse "open math classes"
+    cache = current_semantic_cache()
+    vector = emb.embed_query(question)
+    entry = cache.lookup(vector, subject)
+    if entry is not None:
+        if not cache.should_audit():
+            print(f"[DEBUG] Semantic cache hit ({entry['similarity']:.3f}) for: {entry['question']}")
+            record_semantic_cache("hit")
+            return rehydrate(entry)
+
+        # Audited hit: answer fresh and check the cached one would have shown the same courses
+        response = compute()
+        course_ids = response_course_ids(response)
+        if cache.audit(question, entry, course_ids):
+            record_semantic_cache("audit_match")
+        else:
+            print(f"[DEBUG] Semantic cache false hit for: {entry['question']}")
+            record_semantic_cache("false_hit")
+            cache.store(question, vector, response, course_ids, subject)
+        return response
+
+    record_semantic_cache("miss")
+    response = compute()
+    cache.store(question, vector, response, response_course_ids(response), subject)
+    return response
+
 # 4) Simple router with chat history support
-def answer_with_context(question, chat_history=None):
+def answer_with_context(question, chat_history=None, shard_id=None):
+    # Route to the requested shard, or to the term/campus shard(s) the question is about
+    targets = [s for s in shards if s["id"] == shard_id] or route(question, campuses, shards)
+    print(f"[DEBUG] Routed to shards: {[shard['id'] for shard in targets]}")
+    with timed("request"):
+        answers = [(shard, answer_on_shard(shard, question, chat_history)) for shard in targets]
+    if len(answers) == 1:
+        return answers[0][1]
+    return merge_shard_answers(answers)
+
+def answer_on_shard(shard, question, chat_history=None):
+    record_shard(shard["id"])
+    # Pin one generation for the whole request so a reload can't swap data mid-answer
+    with shard_cache.pin(shard) as generation:
+        token = _generation.set(generation)
+        try:
+            return route_question(question, chat_history)
+        finally:
+            _generation.reset(token)
+
+# Combine answers from several shards, labelling each shard's text
+def merge_shard_answers(answers):
+    texts = []
+    merged_courses = []
+    for shard, answer in answers:
+        try:
+            parsed = json.loads(answer)
+            text, shard_courses = parsed["text"], parsed.get("courses", [])
+        except (ValueError, KeyError, TypeError):
+            text, shard_courses = answer, []
+        texts.append(f"{shard['campus'].title()} ({shard['term']}): {text}")
+        merged_courses.extend(shard_courses)
+    return json.dumps({
+        "text": "\n\n".join(texts),
+        "courses": merged_courses
+    })
+
+def route_question(question, chat_history=None):
     print(f"[DEBUG] Processing question: {question}")
     if chat_history:
         print(f"[DEBUG] Chat history provided with {len(chat_history)} messages")
@@ -424,10 +677,11 @@ def answer_with_context(question, chat_history=None):
     # Special case: meaning of life
     if re.search(r'what\s+is\s+the\s+meaning\s+of\s+life', question.lower()):
         print("[DEBUG] Special case: meaning of life question detected")
-        return json.dumps({
-            "text": "gooning",
-            "courses": []
-        })
+        record_branch("meaning_of_life")
+        return render_response(
+            "gooning",
+            []
+        )
     
     # Extract subject from question to guide search
     requested_subject = extract_subject_from_question(question)
@@ -472,6 +726,34 @@ def answer_with_context(question, chat_history=None):
         requested_subject = subject_mentions[0]
         print(f"[DEBUG] Found subject mention in query: {requested_subject}")
     
+    # Aggregate questions are answered straight from the precomputed department table.
+    # Only department/catalog-wide ones: a course code ("CS 61A", "Data 8") goes down the usual path.
+    names_course = re.search(r'\b[a-z]{2,}\s*\d{1,3}[a-z]{0,2}\b', q_low) is not None
+    asks_distribution = re.search(r'\b(grade distribution|enrollment percentiles?|median enroll\w*)\b', q_low)
+    asks_seat_total = re.search(r'\b(total (?:number of )?open seats|how many open seats)\b', q_low) and \
+        re.search(r'\b(total|overall|altogether|across|all|departments?|catalog|courses|classes)\b', q_low)
+    if not names_course and (asks_distribution or asks_seat_total):
+        depts = subject_to_dept.get(requested_subject)
+        unresolved_scope = None
+        if not depts:
+            # "EL ENG classes", "math courses": try the last one to three words as a department
+            m = re.search(r"((?:\b[a-z]+\s+){1,3})(?:courses|classes|department)\b", q_low)
+            words = m.group(1).split() if m else []
+            for k in range(len(words), 0, -1):
+                dept = " ".join(words[-k:]).upper()
+                if dept in current().courses_by_dept:
+                    depts = [dept]
+                    break
+            if not depts and words and words[-1] not in CATALOG_SCOPE_WORDS:
+                unresolved_scope = words[-1]
+        # The all-departments row only answers questions that ask for a catalog-wide total
+        asks_catalog = re.search(r'\b(total|overall|altogether|across|all|every|catalog)\b', q_low)
+        if depts or (asks_catalog and not unresolved_scope):
+            print("[DEBUG] Matched pattern for department_stats")
+            record_branch("aggregate")
+            return department_stats(depts)
+        print(f"[DEBUG] Aggregate scope {unresolved_scope!r} isn't a department; using the usual path")
+    
     # Check if the query is looking for exact grade matches
     is_exact_match = re.search(r'\b(exactly|precisely|equal\s+to|just)\b', q_low) is not None
     print(f"[DEBUG] Is exact match query: {is_exact_match}")
@@ -540,6 +822,7 @@ def answer_with_context(question, chat_history=None):
     
     if letter_grade:
         print(f"[DEBUG] Final letter grade requirement: {letter_grade}")
+        record_branch("letter_grade")
         
         # Get courses by grade criteria
         grade_courses = find_courses_by_grade(letter_grade, 'letter', exact_match=is_exact_match)
@@ -560,7 +843,7 @@ def answer_with_context(question, chat_history=None):
                     else:
                         print(f"[DEBUG] No courses found in {requested_subject} with grade {letter_grade}")
                         text_response = f"I couldn't find any {requested_subject} courses with an average grade of {letter_grade} or better."
-                        return json.dumps({"text": text_response, "courses": []})
+                        return render_response(text_response, [])
             
             # Filter for open seats only here, after all other filters
             open_courses = [c for c in grade_courses if c["openSeats"] > 0]
@@ -569,7 +852,7 @@ def answer_with_context(question, chat_history=None):
             if not open_courses:
                 subject_text = f"{requested_subject} " if requested_subject else ""
                 text_response = f"I couldn't find any {subject_text}courses with an average grade of {letter_grade} or better that have open seats."
-                return json.dumps({"text": text_response, "courses": []})
+                return render_response(text_response, [])
             
             # Limit the number of courses to return
             selected_courses = open_courses[:5]
@@ -585,10 +868,10 @@ def answer_with_context(question, chat_history=None):
                 course_descriptions = [f"{c['title']} ({c['abbreviation']} {c['courseNumber']}) with a grade average of {c['letterAverage']} ({c['gradeAverage']:.1f})" for c in selected_courses]
                 text_response = f"{subject_text.capitalize()}Courses with an average grade of {letter_grade} {grade_description}: {', '.join(course_descriptions)}"
             
-            result = json.dumps({
-                "text": text_response,
-                "courses": selected_courses
-            })
+            result = render_response(
+                text_response,
+                selected_courses
+            )
             
             print(f"[DEBUG] Returning {len(selected_courses)} courses based on grade criteria")
             return result
@@ -598,7 +881,7 @@ def answer_with_context(question, chat_history=None):
                 text_response = f"I couldn't find any {subject_text}courses with an average grade of exactly {letter_grade}."
             else:
                 text_response = f"I couldn't find any {subject_text}courses with an average grade of {letter_grade} or better."
-            return json.dumps({"text": text_response, "courses": []})
+            return render_response(text_response, [])
     
     elif numeric_match:
         # Extract numeric grade from the match groups
@@ -607,6 +890,7 @@ def answer_with_context(question, chat_history=None):
                 try:
                     min_grade = float(group)
                     print(f"[DEBUG] Found numeric grade requirement: {min_grade}")
+                    record_branch("numeric_grade")
                     
                     grade_courses = find_courses_by_grade(min_grade, 'numeric')
                     
@@ -642,16 +926,16 @@ def answer_with_context(question, chat_history=None):
                             course_descriptions = [f"{c['title']} ({c['abbreviation']} {c['courseNumber']}) with a grade average of {c['gradeAverage']:.1f}" for c in selected_courses]
                             text_response = f"Courses with an average grade of {min_grade} or better: {', '.join(course_descriptions)}"
                         
-                        result = json.dumps({
-                            "text": text_response,
-                            "courses": selected_courses
-                        })
+                        result = render_response(
+                            text_response,
+                            selected_courses
+                        )
                         
                         print(f"[DEBUG] Returning {len(selected_courses)} courses based on numeric grade criteria")
                         return result
                     else:
                         text_response = f"I couldn't find any courses with an average grade of {min_grade} or better."
-                        return json.dumps({"text": text_response, "courses": []})
+                        return render_response(text_response, [])
                 except ValueError:
                     pass  # If we can't convert to a number, continue with normal processing
     
@@ -676,6 +960,7 @@ def answer_with_context(question, chat_history=None):
             target_depts = subject_to_dept[requested_subject]
             available_courses = []
             
+            record_branch("subject_seats")
             for dept in target_depts:
                 available_courses.extend(find_courses_by_dept(dept))
                 
@@ -692,27 +977,29 @@ def answer_with_context(question, chat_history=None):
                     course_descriptions = [f"{c['title']} ({c['abbreviation']} {c['courseNumber']}) with {c['openSeats']} open seats" for c in selected_courses]
                     text_response = f"Available {requested_subject} courses with open seats: {', '.join(course_descriptions)}"
                 
-                result = json.dumps({
-                    "text": text_response,
-                    "courses": selected_courses
-                })
+                result = render_response(
+                    text_response,
+                    selected_courses
+                )
                 
                 print(f"[DEBUG] Returning {len(selected_courses)} courses based on subject")
                 return result
             else:
                 text_response = f"I couldn't find any {requested_subject} courses with open seats."
                 print(f"[DEBUG] No available courses found for {requested_subject}")
-                return json.dumps({"text": text_response, "courses": []})
+                return render_response(text_response, [])
     
     # Check for special patterns in the original question
     q_low = question.lower()
     
     if re.search(r"\b(most|max)\b.*\bopen seats\b", q_low):
         print("[DEBUG] Matched pattern for most_open_seats")
+        record_branch("most_open_seats")
         return most_open_seats()
     
     if re.search(r"\baverage\b.*\benrolled", q_low):
         print("[DEBUG] Matched pattern for avg_enrolled")
+        record_branch("avg_enrolled")
         m = re.search(r"(\w+)\s+courses", q_low)
         dept = m.group(1).upper() if m else None
         return avg_enrolled(dept)
@@ -722,34 +1009,81 @@ def answer_with_context(question, chat_history=None):
        re.search(r"\b(what|which|find|show|list|get|give|display)\b.*\b(courses|classes)\b", q_low) or \
        re.search(r"\b(courses|classes)\b.*\b(open|available|free|have)\b", q_low):
         print("[DEBUG] Matched pattern for courses/classes with open seats")
-        # Get a generic answer from the QA system
-        answer_text = qa.run(context_enhanced_question)
-        print(f"[DEBUG] QA returned: {answer_text[:50]}...")
-        # Always process to JSON format
-        return process_answer(answer_text, question, requested_subject)
+        record_branch("qa_open_seats")
+
+        def answer_open_seats():
+            # Get a generic answer from the QA system
+            answer_text = current().qa.run(context_enhanced_question, callbacks=[metrics_handler])
+            print(f"[DEBUG] QA returned: {answer_text[:50]}...")
+            # Always process to JSON format
+            with timed("process_answer"):
+                return process_answer(answer_text, question, requested_subject)
+
+        return semantic_cached(question, chat_history, answer_open_seats, requested_subject)
     
     # Handle regular queries
     print("[DEBUG] No special patterns matched, using general QA")
-    answer_text = qa.run(context_enhanced_question)
-    print(f"[DEBUG] QA returned: {answer_text[:50]}...")
-    
-    # Try to process, but if no courses are found, return the plain text
-    processed = process_answer(answer_text, question, requested_subject)
-    try:
-        # If we processed but didn't find any courses, return the original text
-        parsed = json.loads(processed)
-        if not parsed.get("courses"):
-            print("[DEBUG] No courses found after processing, returning plain text")
-            return answer_text
-    except Exception as e:
-        print(f"[DEBUG] Error parsing processed answer: {e}")
-    return processed
+    record_branch("qa_fallback")
+
+    def answer_general():
+        answer_text = current().qa.run(context_enhanced_question, callbacks=[metrics_handler])
+        print(f"[DEBUG] QA returned: {answer_text[:50]}...")
+        
+        # Try to process, but if no courses are found, return the plain text
+        with timed("process_answer"):
+            processed = process_answer(answer_text, question, requested_subject)
+        try:
+            # If we processed but didn't find any courses, return the original text
+            parsed = json.loads(processed)
+            if not parsed.get("courses"):
+                print("[DEBUG] No courses found after processing, returning plain text")
+                return answer_text
+        except Exception as e:
+            print(f"[DEBUG] Error parsing processed answer: {e}")
+        return processed
+
+    return semantic_cached(question, chat_history, answer_general, requested_subject)
+
+# Long-running mode: one JSON request per stdin line, one {"id", "answer"} JSON line back.
+# Debug output goes to stderr; snapshot and index updates are picked up without a restart.
+def serve(workers=4):
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    write_lock = threading.Lock()
+    shard_cache.start()
+    start_flusher()
+
+    # Parse here too, so a malformed line gets an error reply instead of ending the loop
+    def handle(line):
+        request_id = None
+        try:
+            input_data = json.loads(line)
+            if not isinstance(input_data, dict):
+                raise ValueError("request must be a JSON object")
+            request_id = input_data.get("id")
+            answer = answer_with_context(input_data.get("question", ""), input_data.get("chatHistory", []), input_data.get("shard"))
+            response = {"id": request_id, "answer": answer}
+        except Exception as e:
+            response = {"id": request_id, "error": str(e)}
+        with write_lock:
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in sys.stdin:
+            if line.strip():
+                pool.submit(handle, line)
+    shard_cache.stop()
 
 # 5) CLI entrypoint
 if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        serve(int(os.getenv("CALGPT_WORKERS", "4")))
+        sys.exit(0)
+
     # Read input as JSON to get both question and chat history
     input_data = json.loads(sys.stdin.readline().strip())
     question = input_data.get("question", "")
     chat_history = input_data.get("chatHistory", [])
     
-    print(answer_with_context(question, chat_history))
+    print(answer_with_context(question, chat_history, input_data.get("shard")))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import threading
+from contextlib import contextmanager
+
+
+class Generation:
+    """One loaded copy of the catalog + index, tagged with the versions it was built from."""
+
+    def __init__(self, number, version, state, close=None):
+        self.number = number
+        self.version = version
+        self.state = state
+        self._close = close
+        self._refs = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["state"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            done = self._retired and self._refs == 0
+        if done:
+            self._shutdown()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            done = self._refs == 0
+        if done:
+            self._shutdown()
+
+    def _shutdown(self):
+        if self._close:
+            self._close(self)
+            self._close = None
+
+
+class ReloadManager:
+    """Rebuilds state in the background when its source versions change and swaps it in atomically.
+
+    `probe()` returns a hashable version (e.g. snapshot ETag + index build id) and must be cheap.
+    `load()` builds the full state dict and returns it with the version it actually loaded;
+    `close(generation)` releases a generation once it has been replaced and the last in-flight
+    request using it has finished.
+    """
+
+    def __init__(self, load, probe, close=None, interval=60):
+        self._load = load
+        self._probe = probe
+        self._close = close
+        self.interval = interval
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        version, state = load()
+        self.current = Generation(1, version, state, close)
+
+    # Hold a reference so a concurrent swap can't close what this request is using
+    def acquire(self):
+        with self._swap_lock:
+            generation = self.current
+            generation.acquire()
+        return generation
+
+    @contextmanager
+    def pin(self):
+        generation = self.acquire()
+        try:
+            yield generation
+        finally:
+            generation.release()
+
+    def check(self):
+        # Only one reload at a time; requests keep using the current generation meanwhile
+        with self._reload_lock:
+            version = self._probe()
+            if version == self.current.version:
+                return False
+
+            print(f"[DEBUG] Reloading generation {self.current.number + 1} for version {version}")
+            version, state = self._load()
+            with self._swap_lock:
+                old = self.current
+                self.current = Generation(old.number + 1, version, state, self._close)
+
+            old.retire()
+            return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="reload-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                # A broken snapshot or half-published index must never take down serving
+                print(f"[DEBUG] Reload failed, keeping generation {self.current.number}: {e}")
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+# Persisted next to the app so hits survive across query.py invocations
+CACHE_PATH = os.getenv("CALGPT_RETRIEVAL_CACHE", "retrieval_cache.sqlite")
+MAX_ENTRIES = int(os.getenv("CALGPT_RETRIEVAL_CACHE_MAX_ENTRIES", "5000"))
+# Random-hyperplane hashing: each of BUCKET_TABLES tables hashes an embedding to
+# BUCKET_BITS sign bits, and a candidate sharing a bucket in any table is checked.
+# Two queries at cosine 0.98 agree on a bit ~93.6% of the time, so one 32-bit table
+# would pair them only ~12% of the time; 8 tables of 16 bits pair them ~97%.
+BUCKET_BITS = int(os.getenv("CALGPT_RETRIEVAL_CACHE_BITS", "16"))
+BUCKET_TABLES = int(os.getenv("CALGPT_RETRIEVAL_CACHE_TABLES", "8"))
+# A bucket hit only counts if the cached query embedding is at least this similar
+MIN_SIMILARITY = float(os.getenv("CALGPT_RETRIEVAL_CACHE_MIN_SIMILARITY", "0.98"))
+# Hit counters and last-used times are written back at most this often (and on exit)
+FLUSH_SECONDS = float(os.getenv("CALGPT_RETRIEVAL_CACHE_FLUSH_SECONDS", "10"))
+# Bumped whenever the tables below change shape; older cache files are rebuilt
+SCHEMA_VERSION = 2
+
+
+def text_key(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+# Quantize an embedding into one bucket id per table with fixed random hyperplanes (SimHash)
+_hyperplanes = {}
+
+
+def embedding_buckets(vector, bits=BUCKET_BITS, tables=BUCKET_TABLES):
+    vector = np.asarray(vector, dtype=np.float32)
+    shape = (tables * bits, vector.shape[0])
+    planes = _hyperplanes.get(shape)
+    if planes is None:
+        rng = np.random.default_rng(0)
+        planes = rng.standard_normal(shape).astype(np.float32)
+        _hyperplanes[shape] = planes
+    signs = ((planes @ vector) > 0).reshape(tables, bits)
+    return [f"{table}:{np.packbits(row).tobytes().hex()}" for table, row in enumerate(signs)]
+
+
+def _cosine(a, b):
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(np.dot(a, b)) / denom if denom else 0.0
+
+
+class RetrievalCache:
+    """Top-k FAISS positions keyed by query text hash and quantized embedding buckets."""
+
+    def __init__(self, build_id, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.build_id = build_id
+        self.max_entries = max_entries
+        # One connection shared by --serve worker threads; every use holds the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("entries", "buckets", "stats"):
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " build_id TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " positions TEXT NOT NULL,"
+            " embed_seconds REAL NOT NULL,"
+            " search_seconds REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (build_id, text_hash))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " build_id TEXT NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " PRIMARY KEY (build_id, bucket, text_hash))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats ("
+            " build_id TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " value REAL NOT NULL,"
+            " PRIMARY KEY (build_id, name))"
+        )
+        # Entries from any other index build point at stale positions
+        self._conn.execute("DELETE FROM entries WHERE build_id != ?", (build_id,))
+        self._conn.execute("DELETE FROM buckets WHERE build_id != ?", (build_id,))
+        self._conn.commit()
+
+        # Hits only bump counters and last-used times; these are batched in memory
+        self._pending_stats = {}
+        self._pending_touches = {}
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def get_by_text(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT positions, embed_seconds, search_seconds FROM entries"
+                " WHERE build_id = ? AND text_hash = ?",
+                (self.build_id, key),
+            ).fetchone()
+        if row is None:
+            return None
+        self._touch(key)
+        return json.loads(row[0]), row[1] + row[2]
+
+    def get_by_bucket(self, buckets, vector):
+        placeholders = ",".join("?" * len(buckets))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT e.text_hash, e.vector, e.positions, e.search_seconds"
+                " FROM buckets b JOIN entries e ON e.build_id = b.build_id AND e.text_hash = b.text_hash"
+                f" WHERE b.build_id = ? AND b.bucket IN ({placeholders})",
+                (self.build_id, *buckets),
+            ).fetchall()
+        best = None
+        best_similarity = MIN_SIMILARITY
+        for text_hash, blob, positions, search_seconds in rows:
+            similarity = _cosine(vector, np.frombuffer(blob, dtype=np.float32))
+            if similarity >= best_similarity:
+                best = (text_hash, positions, search_seconds)
+                best_similarity = similarity
+        if best is None:
+            return None
+        self._touch(best[0])
+        return json.loads(best[1]), best[2]
+
+    def put(self, key, buckets, vector, positions, embed_seconds, search_seconds):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.build_id,
+                    key,
+                    np.asarray(vector, dtype=np.float32).tobytes(),
+                    json.dumps([int(p) for p in positions]),
+                    embed_seconds,
+                    search_seconds,
+                    time.time(),
+                ),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)",
+                [(self.build_id, bucket, key) for bucket in buckets],
+            )
+            # Evict least recently used entries beyond the cap, with their bucket rows
+            self._conn.execute(
+                "DELETE FROM entries WHERE build_id = ? AND text_hash NOT IN ("
+                " SELECT text_hash FROM entries WHERE build_id = ?"
+                " ORDER BY last_used DESC LIMIT ?)",
+                (self.build_id, self.build_id, self.max_entries),
+            )
+            self._conn.execute(
+                "DELETE FROM buckets WHERE build_id = ? AND text_hash NOT IN ("
+                " SELECT text_hash FROM entries WHERE build_id = ?)",
+                (self.build_id, self.build_id),
+            )
+            self._write_pending()
+            self._conn.commit()
+
+    def _touch(self, key):
+        with self._lock:
+            self._pending_touches[key] = time.time()
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._pending_stats[name] = self._pending_stats.get(name, 0) + value
+            due = time.monotonic() - self._last_flush >= FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    # Caller holds the lock
+    def _write_pending(self):
+        self._conn.executemany(
+            "UPDATE entries SET last_used = ? WHERE build_id = ? AND text_hash = ?",
+            [(used, self.build_id, key) for key, used in self._pending_touches.items()],
+        )
+        self._conn.executemany(
+            "INSERT INTO stats VALUES (?, ?, ?)"
+            " ON CONFLICT (build_id, name) DO UPDATE SET value = value + excluded.value",
+            [(self.build_id, name, value) for name, value in self._pending_stats.items()],
+        )
+        self._pending_touches = {}
+        self._pending_stats = {}
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._conn is None or not (self._pending_stats or self._pending_touches):
+                return
+            self._write_pending()
+            self._conn.commit()
+
+    def stats(self):
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, value FROM stats WHERE build_id = ?", (self.build_id,)
+            ).fetchall()
+        return summarize(dict(rows))
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+
+# Stats for a build straight from the file, read-only: opening a RetrievalCache would
+# purge entries that a process still serving another build is using
+def read_stats(build_id, path=CACHE_PATH):
+    if not os.path.exists(path):
+        return summarize({})
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT name, value FROM stats WHERE build_id = ?", (build_id,)).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    return summarize(dict(rows))
+
+
+def summarize(values):
+    hits = values.get("text_hits", 0) + values.get("bucket_hits", 0)
+    lookups = hits + values.get("misses", 0)
+    # Lookups that got as far as embedding, i.e. the ones a bucket hit could serve
+    embedded = lookups - values.get("text_hits", 0)
+    return {
+        "lookups": int(lookups),
+        "text_hits": int(values.get("text_hits", 0)),
+        "bucket_hits": int(values.get("bucket_hits", 0)),
+        "misses": int(values.get("misses", 0)),
+        "hit_ratio": hits / lookups if lookups else 0.0,
+        "bucket_hit_ratio": values.get("bucket_hits", 0) / embedded if embedded else 0.0,
+        "saved_seconds": values.get("saved_seconds", 0.0),
+        "search_seconds": values.get("search_seconds", 0.0),
+    }
+
+
+class CachedRetriever(BaseRetriever):
+    """FAISS retriever that consults a RetrievalCache before embedding and searching."""
+
+    vectorstore: Any
+    cache: Any
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = text_key(query)
+
+        # 1) Exact query text seen before: skip both the embedding call and the search
+        hit = self.cache.get_by_text(key)
+        if hit is not None:
+            positions, saved = hit
+            self.cache.record(text_hits=1, saved_seconds=saved)
+            return self.vectorstore.docstore.search_positions(positions)
+
+        start = time.perf_counter()
+        vector = self.vectorstore.embeddings.embed_query(query)
+        embed_seconds = time.perf_counter() - start
+        buckets = embedding_buckets(vector)
+
+        # 2) Near-identical embedding sharing a bucket in any table: skip the vector search
+        hit = self.cache.get_by_bucket(buckets, np.asarray(vector, dtype=np.float32))
+        if hit is not None:
+            positions, saved = hit
+            self.cache.put(key, buckets, vector, positions, embed_seconds, saved)
+            self.cache.record(bucket_hits=1, saved_seconds=saved)
+            return self.vectorstore.docstore.search_positions(positions)
+
+        # 3) Miss: search FAISS and remember the top-k positions
+        start = time.perf_counter()
+        _, indices = self.vectorstore.index.search(np.array([vector], dtype=np.float32), self.k)
+        search_seconds = time.perf_counter() - start
+        positions = [int(i) for i in indices[0] if i != -1]
+        self.cache.put(key, buckets, vector, positions, embed_seconds, search_seconds)
+        self.cache.record(misses=1, search_seconds=search_seconds)
+        return self.vectorstore.docstore.search_positions(positions)
+
+
+# Print hit ratio and saved time for each shard's current index build
+# python retrieval_cache.py [--shard <id> ...]  (defaults to every shard in shards.json)
+if __name__ == "__main__":
+    from docstore import read_manifest
+    from shards import load_shards, select_shards
+
+    _, shards = load_shards()
+    print(json.dumps({
+        shard["id"]: read_stats(read_manifest(shard["index"])["build_id"], path=shard["retrieval_cache"])
+        for shard in select_shards(shards)
+    }, indent=2))
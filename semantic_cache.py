@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Persisted like the retrieval cache so paraphrases hit across query.py invocations
+CACHE_PATH = os.getenv("CALGPT_SEMANTIC_CACHE", "semantic_cache.sqlite")
+# Cosine similarity a new question needs to reuse a stored answer
+THRESHOLD = float(os.getenv("CALGPT_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Vectors + stored responses are evicted least-recently-hit first beyond this size
+MAX_BYTES = int(os.getenv("CALGPT_SEMANTIC_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Fraction of hits that are recomputed anyway to audit for false hits
+AUDIT_RATE = float(os.getenv("CALGPT_SEMANTIC_CACHE_AUDIT_RATE", "0.05"))
+# Hit counts and last-hit times are written back at most this often (and on exit)
+FLUSH_SECONDS = float(os.getenv("CALGPT_SEMANTIC_CACHE_FLUSH_SECONDS", "10"))
+# Bumped whenever the answers table changes shape; older cached answers are dropped
+SCHEMA_VERSION = 2
+
+
+class MemoizedEmbeddings(Embeddings):
+    """Remembers recent query embeddings so the answer cache and the retriever share one API call."""
+
+    def __init__(self, embeddings, size=256):
+        self.embeddings = embeddings
+        self.size = size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self._lock:
+            if text in self._memo:
+                self._memo.move_to_end(text)
+                return self._memo[text]
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._memo[text] = vector
+            if len(self._memo) > self.size:
+                self._memo.popitem(last=False)
+        return vector
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Stored QA responses looked up by nearest past question embedding, per index build.
+
+    Answers are also keyed by the subject the question asked about, since "open CS
+    classes" and "open math classes" embed close together but must not share courses.
+    """
+
+    def __init__(self, data_version, path=CACHE_PATH, threshold=THRESHOLD, max_bytes=MAX_BYTES, audit_rate=AUDIT_RATE):
+        self.data_version = data_version
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.audit_rate = audit_rate
+        # One connection shared by --serve worker threads; every use (and the matrix) holds the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS answers")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY,"
+            " data_version TEXT NOT NULL,"
+            " subject TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " response TEXT NOT NULL,"
+            " course_ids TEXT NOT NULL,"
+            " bytes INTEGER NOT NULL,"
+            " last_hit REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS audits ("
+            " data_version TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " cached_question TEXT NOT NULL,"
+            " similarity REAL NOT NULL,"
+            " matched INTEGER NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        # Answers from another index build may cite documents that no longer exist
+        self._conn.execute("DELETE FROM answers WHERE data_version != ?", (data_version,))
+        self._conn.commit()
+
+        rows = self._conn.execute(
+            "SELECT id, subject, vector FROM answers WHERE data_version = ?", (data_version,)
+        ).fetchall()
+        self._ids = [r[0] for r in rows]
+        self._subjects = [r[1] for r in rows]
+        self._matrix = np.array([np.frombuffer(r[2], dtype=np.float32) for r in rows]) if rows else None
+
+        # Hits only bump hits/last_hit; these are batched in memory like the retrieval cache's
+        self._pending_hits = {}
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def lookup(self, vector, subject=None):
+        subject = subject or ""
+        with self._lock:
+            if self._matrix is None or subject not in self._subjects:
+                return None
+            similarities = self._matrix @ _normalize(vector)
+            similarities[np.array(self._subjects) != subject] = -np.inf
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            entry_id = self._ids[best]
+            if similarity < self.threshold:
+                return None
+            row = self._conn.execute(
+                "SELECT question, response, course_ids FROM answers WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            hits = self._pending_hits.get(entry_id, (0, 0))[1]
+            self._pending_hits[entry_id] = (time.time(), hits + 1)
+            due = time.monotonic() - self._last_flush >= FLUSH_SECONDS
+        if due:
+            self.flush()
+        return {
+            "id": entry_id,
+            "question": row[0],
+            "response": row[1],
+            "course_ids": json.loads(row[2]),
+            "similarity": similarity,
+        }
+
+    def store(self, question, vector, response, course_ids, subject=None):
+        subject = subject or ""
+        vector = _normalize(vector)
+        size = vector.nbytes + len(response.encode("utf-8"))
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (data_version, subject, question, vector, response, course_ids, bytes, last_hit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.data_version, subject, question, vector.tobytes(), response, json.dumps(course_ids), size, time.time()),
+            )
+            self._ids.append(cursor.lastrowid)
+            self._subjects.append(subject)
+            self._matrix = vector[None, :] if self._matrix is None else np.vstack([self._matrix, vector])
+            # Eviction orders by last_hit, so pending hits go in first
+            self._write_pending()
+            self._evict()
+            self._conn.commit()
+
+    def forget(self, entry_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+            self._conn.commit()
+            self._drop([entry_id])
+
+    def should_audit(self):
+        return random.random() < self.audit_rate
+
+    def audit(self, question, entry, course_ids):
+        # A hit is false when a fresh answer would have shown different courses
+        matched = sorted(course_ids) == sorted(entry["course_ids"])
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO audits VALUES (?, ?, ?, ?, ?, ?)",
+                (self.data_version, question, entry["question"], entry["similarity"], int(matched), time.time()),
+            )
+            self._conn.commit()
+        if not matched:
+            self.forget(entry["id"])
+        return matched
+
+    # Caller holds the lock and commits
+    def _evict(self):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM answers WHERE data_version = ?", (self.data_version,)
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for entry_id, size in self._conn.execute(
+            "SELECT id, bytes FROM answers WHERE data_version = ? ORDER BY last_hit", (self.data_version,)
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append(entry_id)
+            total -= size
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in evicted])
+        self._drop(evicted)
+
+    # Caller holds the lock
+    def _drop(self, entry_ids):
+        drop = set(entry_ids)
+        keep = [i for i, entry_id in enumerate(self._ids) if entry_id not in drop]
+        self._ids = [self._ids[i] for i in keep]
+        self._subjects = [self._subjects[i] for i in keep]
+        self._matrix = self._matrix[keep] if keep else None
+        for entry_id in drop:
+            self._pending_hits.pop(entry_id, None)
+
+    # Caller holds the lock
+    def _write_pending(self):
+        self._conn.executemany(
+            "UPDATE answers SET last_hit = ?, hits = hits + ? WHERE id = ?",
+            [(last_hit, hits, entry_id) for entry_id, (last_hit, hits) in self._pending_hits.items()],
+        )
+        self._pending_hits = {}
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._conn is None or not self._pending_hits:
+                return
+            self._write_pending()
+            self._conn.commit()
+
+    def stats(self):
+        self.flush()
+        with self._lock:
+            return _stats(self._conn, self.data_version, self.max_bytes)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+
+def _stats(conn, data_version, max_bytes):
+    entries, size, hits = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(bytes), 0), COALESCE(SUM(hits), 0) FROM answers WHERE data_version = ?",
+        (data_version,),
+    ).fetchone()
+    audits, matched = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(matched), 0) FROM audits WHERE data_version = ?",
+        (data_version,),
+    ).fetchone()
+    return {
+        "entries": entries,
+        "bytes": size,
+        "max_bytes": max_bytes,
+        "hits": hits,
+        "audits": audits,
+        "false_hits": audits - matched,
+        "false_hit_ratio": (audits - matched) / audits if audits else 0.0,
+    }
+
+
+# Stats for a build straight from the file, read-only: opening a SemanticCache would
+# purge answers that a process still serving another build is using
+def read_stats(data_version, path=CACHE_PATH, max_bytes=MAX_BYTES):
+    empty = {"entries": 0, "bytes": 0, "max_bytes": max_bytes, "hits": 0, "audits": 0, "false_hits": 0, "false_hit_ratio": 0.0}
+    if not os.path.exists(path):
+        return empty
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return _stats(conn, data_version, max_bytes)
+    except sqlite3.OperationalError:
+        # Written by an older schema or not initialised yet
+        return empty
+    finally:
+        conn.close()
+
+
+# Print entry count, size and false-hit audits for each shard's current index build
+# python semantic_cache.py [--shard <id> ...]  (defaults to every shard in shards.json)
+if __name__ == "__main__":
+    from docstore import read_manifest
+    from shards import load_shards, select_shards
+
+    _, shards = load_shards()
+    print(json.dumps({
+        shard["id"]: read_stats(read_manifest(shard["index"])["build_id"], path=shard["semantic_cache"])
+        for shard in select_shards(shards)
+    }, indent=2))
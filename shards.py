@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# One shard = one term at one campus, with its own snapshot, aggregates and index.
+# The first shard listed is the default; the first shard of each campus is that
+# campus's default term. Paths a shard doesn't set live under shards/<id>/.
+SHARDS_FILE = "shards.json"
+MANIFEST_FILE = os.path.join("shards", "manifest.json")
+PAGES_URL = "https://masonarditi.github.io/calgpt-2025/"
+
+# Resident shards are evicted least-recently-used beyond either limit
+SHARD_CACHE_MB = float(os.getenv("CALGPT_SHARD_CACHE_MB", "512"))
+SHARD_CACHE_MAX = int(os.getenv("CALGPT_SHARD_CACHE_MAX", "4"))
+
+
+def load_shards(path=SHARDS_FILE):
+    with open(path, "r") as f:
+        config = json.load(f)
+    shards = []
+    for shard in config["shards"]:
+        folder = os.path.join("shards", shard["id"])
+        shard = dict(shard)
+        shard.setdefault("term_aliases", [])
+        shard.setdefault("snapshot", os.path.join(folder, "course_results.json"))
+        shard.setdefault("aggregates", os.path.join(folder, "course_aggregates.json"))
+        shard.setdefault("index", os.path.join(folder, "faiss_index"))
+        shard.setdefault("retrieval_cache", os.path.join(folder, "retrieval_cache.sqlite"))
+        shard.setdefault("semantic_cache", os.path.join(folder, "semantic_cache.sqlite"))
+        # Snapshots are published to GitHub Pages under the same relative paths
+        shard.setdefault("data_url", PAGES_URL + shard["snapshot"].replace(os.sep, "/"))
+        shard.setdefault("aggregates_url", PAGES_URL + shard["aggregates"].replace(os.sep, "/"))
+        shards.append(shard)
+    return config.get("campuses", {}), shards
+
+
+# Shards named on the command line (--shard <id>, repeatable), or all of them
+def select_shards(shards, argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    wanted = [argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg == "--shard"]
+    if not wanted:
+        return shards
+    unknown = set(wanted) - {s["id"] for s in shards}
+    if unknown:
+        raise SystemExit(f"Unknown shard(s): {', '.join(sorted(unknown))}")
+    return [s for s in shards if s["id"] in wanted]
+
+
+def ensure_parent(path):
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+
+# Record what fetch_courses.py / build_index.py last produced for a shard
+def update_manifest(shard, path=MANIFEST_FILE, **fields):
+    ensure_parent(path)
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        raw = f.read()
+        manifest = json.loads(raw) if raw else {}
+        entry = manifest.setdefault(shard["id"], {})
+        entry.update(
+            campus=shard["campus"],
+            term=shard["term"],
+            snapshot=shard["snapshot"],
+            aggregates=shard["aggregates"],
+            index=shard["index"],
+            **fields,
+        )
+        entry["updated_at"] = time.time()
+        f.seek(0)
+        f.truncate()
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _mentions(text, phrases):
+    return any(re.search(r"\b" + re.escape(p.lower()) + r"\b", text) for p in phrases)
+
+
+# Pick the shard(s) a question is about: campus mentions narrow it down first, then
+# term mentions. No campus -> the default campus; no term -> each campus's default term.
+def route(question, campuses, shards):
+    q_low = question.lower()
+
+    mentioned_campuses = [c for c, aliases in campuses.items() if _mentions(q_low, aliases + [c])]
+    if not mentioned_campuses:
+        mentioned_campuses = [shards[0]["campus"]]
+    candidates = [s for s in shards if s["campus"] in mentioned_campuses]
+
+    by_term = [s for s in candidates if _mentions(q_low, s["term_aliases"] or [s["term"]])]
+    if by_term:
+        return by_term
+
+    defaults = OrderedDict()
+    for shard in candidates:
+        defaults.setdefault(shard["campus"], shard)
+    return list(defaults.values())
+
+
+class ShardCache:
+    """LRU of per-shard reload managers, bounded by count and estimated resident bytes.
+
+    `open_shard(shard)` returns a started-or-not ReloadManager for the shard and
+    `size(manager)` estimates its current generation's memory in bytes. Evicted
+    shards stop watching and their generation closes once in-flight requests finish.
+    """
+
+    def __init__(self, open_shard, size, max_bytes=SHARD_CACHE_MB * 1024 * 1024, max_shards=SHARD_CACHE_MAX):
+        self._open = open_shard
+        self._size = size
+        self.max_bytes = max_bytes
+        self.max_shards = max_shards
+        self.watch = False
+        self._managers = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def manager(self, shard):
+        shard_id = shard["id"]
+        with self._lock:
+            if shard_id in self._managers:
+                self._managers.move_to_end(shard_id)
+                return self._managers[shard_id]
+            loading = self._loading.setdefault(shard_id, threading.Lock())
+
+        # Load outside the cache lock so other shards keep serving meanwhile
+        with loading:
+            with self._lock:
+                if shard_id in self._managers:
+                    return self._managers[shard_id]
+            print(f"[DEBUG] Loading shard {shard_id}")
+            manager = self._open(shard)
+            if self.watch:
+                manager.start()
+            with self._lock:
+                self._managers[shard_id] = manager
+                self._loading.pop(shard_id, None)
+                evicted = self._evict(keep=shard_id)
+        if evicted:
+            # stop() joins the shard's reload thread, which may be mid-fetch; don't make
+            # a request for some other shard wait on that
+            threading.Thread(target=self._retire, args=(evicted,), name="shard-evict", daemon=True).start()
+        return manager
+
+    @staticmethod
+    def _retire(evicted):
+        for old_id, old in evicted:
+            print(f"[DEBUG] Evicting shard {old_id}")
+            old.stop()
+            old.current.retire()
+
+    @contextmanager
+    def pin(self, shard):
+        # Pin under the cache lock so the shard can't be evicted between lookup and pin
+        while True:
+            manager = self.manager(shard)
+            with self._lock:
+                if self._managers.get(shard["id"]) is manager:
+                    generation = manager.acquire()
+                    break
+        try:
+            yield generation
+        finally:
+            generation.release()
+
+    def start(self):
+        self.watch = True
+        with self._lock:
+            managers = list(self._managers.values())
+        for manager in managers:
+            manager.start()
+
+    def stop(self):
+        with self._lock:
+            managers = list(self._managers.values())
+        for manager in managers:
+            manager.stop()
+
+    def _evict(self, keep):
+        evicted = []
+        total = sum(self._size(m) for m in self._managers.values())
+        while len(self._managers) > 1 and (total > self.max_bytes or len(self._managers) > self.max_shards):
+            shard_id = next(iter(self._managers))
+            if shard_id == keep:
+                break
+            manager = self._managers.pop(shard_id)
+            total -= self._size(manager)
+            evicted.append((shard_id, manager))
+        return evicted
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import math
+import re
+from collections import Counter, defaultdict
+
+# Fuzzy (non-containment) matches need this Dice score. Lower cutoffs let a shared
+# "Introduction to" decide the match: "Introduction to Probability" vs
+# "Introduction to Programming" scores 0.68.
+MIN_SCORE = 0.75
+
+
+def normalize_title(text):
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def trigrams(text):
+    padded = f"  {normalize_title(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Trigram inverted index over course titles, built once per catalog snapshot.
+
+    search() first accepts containment matches, following the old substring loop but on
+    whole words only: any title that appears in the text ("Special Topics in Data
+    Structures for Engineers" finds "Data Structures"), and any title the text appears
+    in when the text is more than half the title's length. Other titles need a Dice
+    coefficient of their trigram sets of at least min_score. Containment matches rank first.
+    titles_in() is the first half alone, for finding titles mentioned in an answer.
+    """
+
+    def __init__(self, courses):
+        self.courses = courses
+        self.titles = [normalize_title(course["title"]) for course in courses]
+        self.grams = [trigrams(course["title"]) for course in courses]
+        self.by_title = defaultdict(list)
+        for i, title in enumerate(self.titles):
+            self.by_title[title].append(i)
+        self.max_words = max((len(title.split()) for title in self.titles), default=0)
+        self.postings = defaultdict(list)
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings[gram].append(i)
+
+    # Titles that appear in the normalized text: runs of its words no longer than any title
+    def _held_in(self, text):
+        found = set()
+        words = text.split()
+        for start in range(len(words)):
+            span = ""
+            for word in words[start:start + self.max_words]:
+                span = f"{span} {word}" if span else word
+                found.update(self.by_title.get(span, ()))
+        return found
+
+    # Courses whose titles appear in the text as whole words, in catalog order
+    def titles_in(self, text):
+        return [self.courses[i] for i in sorted(self._held_in(normalize_title(text)))]
+
+    # Titles the normalized text contains, or that contain it at > half their length
+    def _containing(self, text):
+        found = self._held_in(text)
+        # Titles holding the text all have the text's rarest trigram
+        inner = [text[i:i + 3] for i in range(len(text) - 2)]
+        if inner:
+            rarest = min(inner, key=lambda g: len(self.postings.get(g, ())))
+            padded = f" {text} "
+            for i in self.postings.get(rarest, ()):
+                if len(self.titles[i]) < 2 * len(text) and padded in f" {self.titles[i]} ":
+                    found.add(i)
+        return found
+
+    def search(self, text, limit=5, min_score=MIN_SCORE):
+        query = trigrams(text)
+        if not query:
+            return []
+        contained = self._containing(normalize_title(text))
+
+        # A title scoring >= min_score shares at least `needed` trigrams with the query, so it
+        # must appear under one of the len(query) - needed + 1 rarest ones (prefix filtering).
+        # Common trigrams like " in" then only count toward scores, never toward candidates.
+        ordered = sorted(query, key=lambda g: len(self.postings.get(g, ())))
+        needed = max(1, math.ceil(min_score * len(query) / (2 - min_score)))
+        prefix = ordered[:len(query) - needed + 1]
+        rest = len(query) - len(prefix)
+        shared_in_prefix = Counter()
+        for gram in prefix:
+            shared_in_prefix.update(self.postings.get(gram, ()))
+
+        scored = [(True, self._dice(query, i), i) for i in contained]
+        for i, shared in shared_in_prefix.items():
+            if i in contained:
+                continue
+            # Skip the exact overlap when even matching every remaining trigram can't reach min_score
+            if 2 * (shared + rest) < min_score * (len(query) + len(self.grams[i])):
+                continue
+            score = self._dice(query, i)
+            if score >= min_score and self._weighted_dice(query, i) >= min_score:
+                scored.append((False, score, i))
+        scored.sort(key=lambda s: (not s[0], -s[1], s[2]))
+        return [(self.courses[i], score) for _, score, i in scored[:limit]]
+
+    def _dice(self, query, i):
+        grams = self.grams[i]
+        return 2 * len(query & grams) / (len(query) + len(grams))
+
+    # Dice with trigrams weighted by rarity, so a prefix many titles share counts for little
+    def _weighted_dice(self, query, i):
+        grams = self.grams[i]
+        total = len(self.courses) + 1
+        weight = lambda g: math.log(total / (len(self.postings.get(g, ())) or 1))
+        return 2 * sum(map(weight, query & grams)) / (sum(map(weight, query)) + sum(map(weight, grams)))